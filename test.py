@@ -1,14 +1,16 @@
-import requests
-from bs4 import BeautifulSoup
-import csv
+import asyncio
+import hishel
+import httpx
+import lxml.html
+from lxml import etree
 import logging
+import re
 import time
-import os
 import random
 import yaml
+from itertools import cycle
 from pathlib import Path
-from typing import Optional, Dict, List
-import csv
+from typing import BinaryIO, Optional, Dict, List
 
 
 
@@ -26,215 +28,289 @@ def load_config(filename: str) -> Dict:
         with open(filename, 'r') as file:
             return yaml.safe_load(file)
     except FileNotFoundError as e:
-        logging.error(f"Config file not found: {e}")
+        logging.error("Config file not found: %s", e)
         raise
 
-def choose_user_agent(user_agents: List[str]) -> str:
+class UserAgentCycle:
     """
-    Randomly choose a user agent from a list.
+    Rotation over a pre-shuffled cycle of user agents.
 
-    Args:
-        user_agents (List[str]): A list of user agents.
+    Shuffling once and cycling replaces a PRNG draw per request with an
+    O(1) next(). All fetch tasks run on one event loop, so no locking is
+    needed around the rotation.
+    """
 
-    Returns:
-        str: A randomly chosen user agent.
+    def __init__(self, user_agents: List[str]) -> None:
+        self._cycle = cycle(random.sample(user_agents, len(user_agents)))
+
+    def next(self) -> str:
+        return next(self._cycle)
+
+_content_encoding_logged = False  # Log the server's Content-Encoding once
+
+MAX_RETRIES = 3  # Status-code retries per page, on top of transport-level connect retries
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+RETRY_BACKOFF_FACTOR = 0.5  # Seconds; doubled on each attempt
+
+class RateLimiter:
+    """
+    Token-bucket rate limiter shared across fetch tasks.
+
+    Each caller claims the next slot on a monotonic schedule and awaits
+    only its own remaining delay, so the average rate is one request per
+    `interval` seconds and tasks never chain idle time when the server
+    is the slow side. Slot claiming has no await point, so it needs no
+    lock on a single event loop.
     """
-    return random.choice(user_agents)
 
-def get_html(url: str, session: requests.Session) -> Optional[str]:
+    def __init__(self, interval: float) -> None:
+        self._interval = interval
+        self._next_time = time.monotonic()
+
+    async def acquire(self) -> None:
+        now = time.monotonic()
+        slot = max(now, self._next_time)
+        self._next_time = slot + self._interval
+        delay = slot - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def refund(self) -> None:
+        """
+        Hand an acquired slot back, rolling the next slot time back.
+
+        Used when a request never hit the network (served from cache), so
+        fully-cached reruns are not paced by the politeness budget.
+        """
+        self._next_time -= self._interval
+
+async def get_html(url: str, client: httpx.AsyncClient, headers: Optional[Dict] = None,
+                   limiter: Optional[RateLimiter] = None) -> Optional[bytes]:
     """
-    Retrieve HTML content from a URL using a given requests session.
+    Retrieve HTML content from a URL using a given httpx client.
+
+    Returns the raw response bytes rather than `response.text`, which
+    skips per-page charset detection — lxml does its own encoding
+    detection in C when fed bytes. Rate-limit and server errors are
+    retried with exponential backoff before giving up on a page. When
+    the response came from the cache, the caller's rate-limiter slot is
+    refunded since no network request was made.
 
     Args:
         url (str): The URL to fetch.
-        session (requests.Session): The requests session.
+        client (httpx.AsyncClient): The shared HTTP client.
+        headers (Optional[Dict]): Extra headers for this request only.
+        limiter (Optional[RateLimiter]): Limiter to refund on cache hits.
 
     Returns:
-        Optional[str]: The HTML content if successful, None otherwise.
+        Optional[bytes]: The HTML content if successful, None otherwise.
     """
+    global _content_encoding_logged
     try:
-        response = session.get(url)
+        response = await client.get(url, headers=headers)
+        for attempt in range(MAX_RETRIES):
+            if response.status_code not in RETRY_STATUS_CODES:
+                break
+            backoff = RETRY_BACKOFF_FACTOR * (2 ** attempt)
+            logging.warning("Got %d for %s, retrying in %.1fs", response.status_code, url, backoff)
+            await asyncio.sleep(backoff)
+            response = await client.get(url, headers=headers)
         response.raise_for_status()
-        return response.text
-    except requests.RequestException as e:
-        logging.error(f"Failed to retrieve the webpage: {e}")
+        if limiter is not None and response.extensions.get('from_cache'):
+            limiter.refund()
+        if not _content_encoding_logged:
+            _content_encoding_logged = True
+            logging.info("HTTP version: %s, Content-Encoding: %s",
+                         response.http_version, response.headers.get('Content-Encoding'))
+        return response.content
+    except httpx.HTTPError as e:
+        logging.error("Failed to retrieve the webpage: %s", e)
         return None
 
-def save_table_to_csv(table: BeautifulSoup, filename: str, include_headers: bool) -> None:
-    """
-    Save a BeautifulSoup table to a CSV file with custom data extraction for specific columns.
-    """
-    try:
-        rows = table.find_all('tr')
-        with open(filename, 'a' if not include_headers else 'w', newline='', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            if include_headers:
-                headers = [header.get_text(strip=True) for header in rows[0].find_all(['th'])]
-                writer.writerow(headers)
-                rows = rows[1:]  # Skip the header row for data rows
-
-            for row in rows:
-                csv_row = []
-                for index, cell in enumerate(row.find_all(['td', 'th'])):
-                    if index == 1:  # Special handling for the second column
-                        player_name = cell.find('a').get_text(strip=True) if cell.find('a') else ''
-                        csv_row.append(player_name)
-                    elif index == 5:  # Special handling for the sixth column
-                        team_name = cell.find('a').get_text(strip=True) if cell.find('a') else ''
-                        csv_row.append(team_name)
-                    else:
-                        cell_text = cell.get_text(strip=True).replace('\n', ' ').replace('\r', '').strip()
-                        csv_row.append(cell_text)
-
-                writer.writerow(csv_row)
-        logging.info(f"Data appended to {filename}")
-    except IOError as e:
-        logging.error(f"Error saving table to {filename}: {e}")
+POTENTIAL_COL_INDEX = 2  # Index of the 'Potential' column in the scraped table
+HEIGHT_RE = re.compile(r'(\d+)(?:cm|kg)')  # Matches 'xxxcm' in 'xxxcm / y\'y"' and 'xxkg' in 'xxkg / yyylbs'
+WS_RE = re.compile(r'[\r\n]+')  # Line breaks inside cell text, collapsed to spaces
 
-def fetch_and_save_first_table(url: str, offset: int, session: requests.Session, filename: str, include_headers: bool) -> None:
-    """
-    Fetch the first table from the given URL and save it as a CSV file.
+def clean_row(row: List[str]) -> Optional[List[str]]:
     """
-    logging.info(f"Fetching data from URL: {offset}")
-    html = get_html(url, session)
-    if html:
-        soup = BeautifulSoup(html, 'html.parser')
-        first_table = soup.find('table')
-        if first_table:
-            save_table_to_csv(first_table, filename, include_headers)
-        else:
-            logging.info("No table found in the HTML.")
-        time.sleep(3)
+    Apply the cleaning transforms to a single scraped row.
 
-def remove_rows_with_non_integer_potential(input_file, output_file, potential_column_index):
-    """
-    Remove rows from the CSV where the 'Potential' column does not contain an integer, except for the header row.
+    Drops rows whose 'Potential' column is not an integer, strips empty
+    leading/trailing fields, and trims the height and weight columns to
+    their metric digits.
 
     Args:
-        input_file (str): The path to the input CSV file.
-        output_file (str): The path to the output CSV file.
-        potential_column_index (int): The index of the 'Potential' column in the CSV.
-    """
-    with open(input_file, 'r', newline='', encoding='utf-8') as infile, \
-         open(output_file, 'w', newline='', encoding='utf-8') as outfile:
-        
-        reader = csv.reader(infile)
-        writer = csv.writer(outfile)
-
-        # Write the header row
-        header_row = next(reader)
-        writer.writerow(header_row)
-
-        for row in reader:
-            # Check if the row has enough columns
-            if len(row) > potential_column_index:
-                try:
-                    # Check if the 'Potential' value is an integer
-                    int(row[potential_column_index])
-                    # Write the row to the output file
-                    writer.writerow(row)
-                except ValueError:
-                    # Skip rows where 'Potential' is not an integer
-                    continue
-
-def clean_csv(input_file, output_file):
-    """
-    Clean each row in the CSV by removing the first and last commas.
+        row (List[str]): The raw row extracted from the table.
 
-    Args:
-        input_file (str): The path to the input CSV file.
-        output_file (str): The path to the output CSV file.
+    Returns:
+        Optional[List[str]]: The cleaned row, or None if it should be dropped.
     """
-    with open(input_file, 'r', newline='', encoding='utf-8') as infile, \
-         open(output_file, 'w', newline='', encoding='utf-8') as outfile:
-        
-        reader = csv.reader(infile)
-        writer = csv.writer(outfile)
+    if len(row) <= POTENTIAL_COL_INDEX:
+        return None
+    try:
+        int(row[POTENTIAL_COL_INDEX])
+    except ValueError:
+        return None
+    # Remove the first and last elements if they're empty
+    if row[0] == '':
+        row = row[1:]
+    if row[-1] == '':
+        row = row[:-1]
+    # Extract only the metric digits for height and weight
+    for height_column_index in (5, 6):
+        if len(row) > height_column_index:
+            match = HEIGHT_RE.match(row[height_column_index])
+            row[height_column_index] = match.group(1) if match else ''
+    return row
+
+def encode_csv_rows(rows: List[List[str]]) -> bytes:
+    """
+    Encode rows as CSV bytes with every field quoted.
+
+    A straight bytes join skips csv.writer's per-row quoting state
+    machine; doubling embedded quotes keeps the output valid CSV even
+    for the rare field containing a quote, comma, or newline.
 
-        for row in reader:
-            if row:
-                # Remove the first element if it's empty
-                if row[0] == '':
-                    row = row[1:]
-                # Remove the last element if it's empty
-                if row[-1] == '':
-                    row = row[:-1]
+    Args:
+        rows (List[List[str]]): The rows to encode.
 
-                writer.writerow(row)
+    Returns:
+        bytes: The encoded CSV lines.
+    """
+    return b''.join(
+        b'"' + b'","'.join(field.replace('"', '""').encode('utf-8') for field in row) + b'"\r\n'
+        for row in rows
+    )
 
-def modify_column(input_file, output_file, height_column_index):
+def anchor_text(cell: lxml.html.HtmlElement) -> str:
     """
-    Modify the column in the CSV to only include the height in centimeters.
+    Extract the first anchor's text from a cell, or '' if there is none.
+    """
+    anchor = cell.find('.//a')
+    return anchor.text.strip() if anchor is not None and anchor.text else ''
 
-    Args:
-        input_file (str): The path to the input CSV file.
-        output_file (str): The path to the output CSV file.
-        height_column_index (int): The index of the 'Height' column in the CSV.
+def text_strip(cell: lxml.html.HtmlElement) -> str:
+    """
+    Extract a cell's text content with line breaks collapsed to spaces.
     """
-    with open(input_file, 'r', newline='', encoding='utf-8') as infile, \
-         open(output_file, 'w', newline='', encoding='utf-8') as outfile:
-        
-        reader = csv.reader(infile)
-        writer = csv.writer(outfile)
+    return WS_RE.sub(' ', cell.text_content()).strip()
 
-        for row in reader:
-            if len(row) > height_column_index:
-                # Extract only the 'xxxcm' part for height
-                height_data = row[height_column_index].split(' ')[0]  # Assumes format 'xxxcm / y'y"'
-                height_data = height_data[:-2]
-                row[height_column_index] = height_data
+EXTRACTORS = {1: anchor_text, 5: anchor_text}  # Player and team name columns
 
-            writer.writerow(row)
+def save_table_to_csv(table: lxml.html.HtmlElement, file: BinaryIO, include_headers: bool) -> None:
+    """
+    Write an lxml table element to an open CSV file, cleaning each row as it is written.
+    """
+    try:
+        rows = table.xpath('.//tr')
+        if include_headers:
+            headers = [header.text_content().strip() for header in rows[0].xpath('./th')]
+            if headers and headers[0] == '':
+                headers = headers[1:]
+            if headers and headers[-1] == '':
+                headers = headers[:-1]
+            file.write(encode_csv_rows([headers]))
+            rows = rows[1:]  # Skip the header row for data rows
+
+        page_rows: List[List[str]] = []
+        for row in rows:
+            csv_row = [EXTRACTORS.get(index, text_strip)(cell)
+                       for index, cell in enumerate(row.xpath('./td|./th'))]
+            cleaned_row = clean_row(csv_row)
+            if cleaned_row:
+                page_rows.append(cleaned_row)
+
+        file.write(encode_csv_rows(page_rows))
+        logging.info("Data appended to %s", file.name)
+    except IOError as e:
+        logging.error("Error saving table to %s: %s", file.name, e)
 
-def remove_files(*file_paths):
+async def fetch_page(url: str, offset: int, client: httpx.AsyncClient, limiter: RateLimiter,
+                     ua_cycle: UserAgentCycle, semaphore: asyncio.Semaphore) -> Optional[bytes]:
+    """
+    Fetch a single results page, bounded by the semaphore and waiting on
+    the shared rate limiter first.
     """
-    Remove the specified files.
+    async with semaphore:
+        await limiter.acquire()
+        logging.info("Fetching data from URL: %d", offset)
+        return await get_html(url, client, headers={'User-Agent': ua_cycle.next()}, limiter=limiter)
 
-    Args:
-        file_paths: A list of file paths to be removed.
-    """
-    for file_path in file_paths:
-        try:
-            os.remove(file_path)
-            print(f"File '{file_path}' successfully removed.")
-        except FileNotFoundError:
-            print(f"File '{file_path}' not found. Cannot be removed.")
-        except Exception as e:
-            print(f"Error occurred while removing file '{file_path}': {e}")
-
-def data_cleaning(filename):
-    input_csv_file = filename
-    remove_headers = "remove_headers.csv"
-    remove_commas = "remove_commas.csv"
-    fix_height = "fix_height.csv"
-    sofifa_players = "sofifa_players.csv"
-    potential_col_index = 2  # Update this to the correct index of the 'Potential' column in your CSV
-    remove_rows_with_non_integer_potential(input_csv_file, remove_headers, potential_col_index)
-    clean_csv(remove_headers, remove_commas)
-    modify_column(remove_commas, fix_height, 5)
-    modify_column(fix_height, sofifa_players, 6)
-    remove_files("remove_headers.csv", "remove_commas.csv", "fix_height.csv", "raw_players.csv")
+def parse_first_table(html: bytes) -> Optional[lxml.html.HtmlElement]:
+    """
+    Stream-parse HTML and return the first table element.
 
+    Feeds the page to a pull parser in chunks and stops as soon as the
+    first table's closing tag is seen, so no tree is built for the rest
+    of the document.
 
+    Args:
+        html (bytes): The raw page content.
 
-if __name__ == "__main__":
-    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    Returns:
+        Optional[lxml.html.HtmlElement]: The first table, or None if absent.
+    """
+    parser = etree.HTMLPullParser(events=('end',), tag='table')
+    parser.set_element_class_lookup(lxml.html.HtmlElementClassLookup())
+    chunk_size = 1 << 16
+    for start in range(0, len(html), chunk_size):
+        parser.feed(html[start:start + chunk_size])
+        for _, table in parser.read_events():
+            return table
+    parser.close()
+    for _, table in parser.read_events():
+        return table
+    return None
+
+def save_first_table(html: bytes, file: BinaryIO, include_headers: bool) -> None:
+    """
+    Parse the first table from the given HTML and write it to an open CSV file.
+    """
+    table = parse_first_table(html)
+    if table is not None:
+        save_table_to_csv(table, file, include_headers)
+    else:
+        logging.info("No table found in the HTML.")
 
+async def main() -> None:
     config = load_config('config.yaml')
-    session = requests.Session()
-    session.headers.update({'User-Agent': choose_user_agent(config['user_agents'])})
+    ua_cycle = UserAgentCycle(config['user_agents'])
 
     base_url = "https://sofifa.com/players?col=oa&sort=desc&showCol%5B0%5D=ae&showCol%5B1%5D=hi&showCol%5B2%5D=wi&showCol%5B3%5D=pf&showCol%5B4%5D=oa&showCol%5B5%5D=pt&showCol%5B6%5D=bo&showCol%5B7%5D=bp&showCol%5B8%5D=gu&showCol%5B9%5D=jt&showCol%5B10%5D=le&showCol%5B11%5D=vl&showCol%5B12%5D=wg&showCol%5B13%5D=rc&showCol%5B14%5D=ta&showCol%5B15%5D=cr&showCol%5B16%5D=fi&showCol%5B17%5D=he&showCol%5B18%5D=sh&showCol%5B19%5D=vo&showCol%5B20%5D=ts&showCol%5B21%5D=dr&showCol%5B22%5D=cu&showCol%5B23%5D=fr&showCol%5B24%5D=lo&showCol%5B25%5D=bl&showCol%5B26%5D=to&showCol%5B27%5D=ac&showCol%5B28%5D=sp&showCol%5B29%5D=ag&showCol%5B30%5D=re&showCol%5B31%5D=ba&showCol%5B32%5D=tp&showCol%5B33%5D=so&showCol%5B34%5D=ju&showCol%5B35%5D=st&showCol%5B36%5D=sr&showCol%5B37%5D=ln&showCol%5B38%5D=te&showCol%5B39%5D=ar&showCol%5B40%5D=in&showCol%5B41%5D=po&showCol%5B42%5D=vi&showCol%5B43%5D=pe&showCol%5B44%5D=cm&showCol%5B45%5D=td&showCol%5B46%5D=ma&showCol%5B47%5D=sa&showCol%5B48%5D=sl&showCol%5B49%5D=tg&showCol%5B50%5D=gd&showCol%5B51%5D=gh&showCol%5B52%5D=gc&showCol%5B53%5D=gp&showCol%5B54%5D=gr&showCol%5B55%5D=tt&showCol%5B56%5D=bs&showCol%5B57%5D=aw&showCol%5B58%5D=dw&showCol%5B59%5D=pac&showCol%5B60%5D=sho&showCol%5B61%5D=pas&showCol%5B62%5D=dri&showCol%5B63%5D=def&showCol%5B64%5D=phy&offset="
     offset_step = 60
     max_offset = 18600
 
-    filename = "raw_players.csv"
-    for offset in range(0, max_offset, offset_step):
-        current_url = f"{base_url}{offset}"
-        fetch_and_save_first_table(current_url, offset, session, filename, include_headers=(offset == 0))
-        time.sleep(3)
+    filename = "sofifa_players.csv"
+    limiter = RateLimiter(interval=3.0)
+    semaphore = asyncio.Semaphore(8)
+    offsets = range(0, max_offset, offset_step)
+    urls = [base_url + str(offset) for offset in offsets]
+    # One HTTP/2 connection multiplexes all in-flight requests; the
+    # transport retries connection errors, get_html retries bad statuses.
+    # Pin compression explicitly; brotli beats gzip when the server offers it
+    transport = httpx.AsyncHTTPTransport(http2=True, retries=3, limits=httpx.Limits(max_connections=1))
+    # Cached responses make reruns skip the network; get_html refunds the
+    # rate-limiter slot on cache hits so cached reruns are not paced either
+    cache_transport = hishel.AsyncCacheTransport(
+        transport=transport,
+        storage=hishel.AsyncSQLiteStorage(ttl=86400),
+        controller=hishel.Controller(force_cache=True),
+    )
+    async with httpx.AsyncClient(transport=cache_transport,
+                                 headers={'Accept-Encoding': 'gzip, deflate, br'}) as client:
+        pages = await asyncio.gather(*(fetch_page(url, offset, client, limiter, ua_cycle, semaphore)
+                                       for url, offset in zip(urls, offsets)))
+
+    # Pages are gathered in offset order, so headers still land on the first page.
+    with open(filename, 'wb', buffering=1048576) as file:
+        for offset, html in zip(offsets, pages):
+            if html:
+                save_first_table(html, file, include_headers=(offset == 0))
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-    data_cleaning(filename)
+    asyncio.run(main())
 
 
 